@@ -0,0 +1,83 @@
+import pandas as pd
+import numpy as np
+from psycopg2.extras import execute_values
+
+# --- SCORING CONFIG ---
+SCORE_WINDOW_MONTHS = 6   # Rolling window of AgencyPerformance months per agency
+RECENCY_DECAY = 0.8       # Weight of a month relative to the one after it
+METRIC_WEIGHTS = {'recoveryRate': 0.5, 'slaAdherence': 0.3, 'dsoScore': 0.2}
+DSO_BEST, DSO_WORST = 30.0, 90.0  # avgDSO (days) mapped linearly onto 100..0
+
+DEFAULT_SCORE = 60.0        # Agencies with no performance history yet
+ESTABLISHED_THRESHOLD = 60.0
+
+def classify_agency(score):
+    return 'Established' if score > ESTABLISHED_THRESHOLD else 'Probationary'
+
+def compute_agency_scores(perf):
+    """
+    Weighted rolling-window score (0-100) for every agency in `perf` in one pass.
+
+    `perf` has one row per (agencyId, month) with recoveryRate, slaAdherence and avgDSO.
+    Returns a DataFrame with agencyId, score and scoredThrough (latest month used).
+    """
+    if perf.empty:
+        return pd.DataFrame(columns=['agencyId', 'score', 'scoredThrough'])
+
+    df = perf.sort_values(['agencyId', 'month'], ascending=[True, False]).reset_index(drop=True)
+
+    # 0 = latest month for the agency, 1 = the month before, ...
+    age = df.groupby('agencyId').cumcount().to_numpy()
+    df = df[age < SCORE_WINDOW_MONTHS]
+    age = age[age < SCORE_WINDOW_MONTHS]
+
+    dso_score = np.clip((DSO_WORST - df['avgDSO'].to_numpy(dtype=float)) / (DSO_WORST - DSO_BEST) * 100.0, 0.0, 100.0)
+    composite = (
+        METRIC_WEIGHTS['recoveryRate'] * df['recoveryRate'].to_numpy(dtype=float)
+        + METRIC_WEIGHTS['slaAdherence'] * df['slaAdherence'].to_numpy(dtype=float)
+        + METRIC_WEIGHTS['dsoScore'] * dso_score
+    )
+    weight = RECENCY_DECAY ** age
+
+    weighted = pd.DataFrame({
+        'agencyId': df['agencyId'].to_numpy(),
+        'month': df['month'].to_numpy(),
+        'wx': weight * composite,
+        'w': weight,
+    })
+    grouped = weighted.groupby('agencyId', sort=False).agg(wx=('wx', 'sum'), w=('w', 'sum'), scoredThrough=('month', 'max'))
+
+    result = grouped.reset_index()
+    result['score'] = (result['wx'] / result['w']).round(2)
+    return result[['agencyId', 'score', 'scoredThrough']]
+
+def refresh_agency_scores(cur, full=False):
+    """
+    Expects a RealDictCursor. Recomputes "Agency"."score" for agencies flagged "scoreDirty"
+    (or all agencies when `full`). Returns the number of agencies updated.
+
+    Writers of AgencyPerformance set "scoreDirty". The flag is cleared before history is read,
+    so the row lock makes a concurrent writer's flag land after this commit and trigger a rescore.
+    """
+    if full:
+        cur.execute('UPDATE "Agency" SET "scoreDirty" = false RETURNING "id"')
+    else:
+        cur.execute('UPDATE "Agency" SET "scoreDirty" = false WHERE "scoreDirty" RETURNING "id"')
+    stale_ids = [r['id'] for r in cur.fetchall()]
+    if not stale_ids:
+        return 0
+
+    cur.execute(
+        'SELECT "agencyId", "month", "recoveryRate", "slaAdherence", "avgDSO" FROM "AgencyPerformance" WHERE "agencyId" = ANY(%s)',
+        (stale_ids,)
+    )
+    perf = pd.DataFrame(cur.fetchall(), columns=['agencyId', 'month', 'recoveryRate', 'slaAdherence', 'avgDSO'])
+
+    scores = compute_agency_scores(perf)
+    execute_values(
+        cur,
+        'UPDATE "Agency" AS a SET "score" = v.score, "scoredThrough" = v.through '
+        'FROM (VALUES %s) AS v(id, score, through) WHERE a."id" = v.id',
+        list(zip(scores['agencyId'], scores['score'].astype(float), scores['scoredThrough']))
+    )
+    return len(scores)
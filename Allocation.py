@@ -7,6 +7,9 @@ import argparse
 import json
 import os
 
+from AgencyScoring import DEFAULT_SCORE, classify_agency, refresh_agency_scores
+from OptimalAllocation import optimal_assign
+
 # --- DATABASE CONNECTION ---
 def get_db_connection():
     # Use DATABASE_URL from environment (passed by Worker)
@@ -26,31 +29,24 @@ def load_agencies():
     cur = conn.cursor(cursor_factory=RealDictCursor)
     try:
         # Fetch only ACTIVE agencies (Soft delete handled by exclusion)
-        cur.execute('SELECT * FROM "Agency" WHERE "status" = \'ACTIVE\'')
+        # Scores are precomputed by AgencyScoring.refresh_agency_scores(); no history is read here
+        cur.execute('SELECT "id", "name", "capacity", "score", "scoredThrough" FROM "Agency" WHERE "status" = \'ACTIVE\'')
         rows = cur.fetchall()
         
         agencies = []
         for r in rows:
-            # Fetch latest performance to derive score
-            cur.execute('SELECT "recoveryRate" FROM "AgencyPerformance" WHERE "agencyId" = %s ORDER BY "month" DESC LIMIT 1', (r['id'],))
-            perf = cur.fetchone()
-            
-            raw_score = 60.0 # Default fallback
-            if perf:
-                 raw_score = float(perf['recoveryRate'])
+            raw_score = DEFAULT_SCORE # Default fallback (no performance history yet)
+            if r['scoredThrough']:
+                 raw_score = float(r['score'])
             
             norm_score = raw_score / 100.0
             
-            # Determine Algo Status (Probationary vs Established) based on score/history
-            # In new model, we can rely on score threshold
-            algo_status = 'Established' if raw_score > 60 else 'Probationary'
-            
             agencies.append({
                 'id': r['id'],
                 'name': r['name'],
                 'score': norm_score,
                 'totalCapacity': r['capacity'], 
-                'status': algo_status
+                'status': classify_agency(raw_score)
             })
             
         print(f"[Allocation.py] Loaded {len(agencies)} active agencies from DB.")
@@ -62,6 +58,30 @@ def load_agencies():
         cur.close()
         conn.close()
 
+def refresh_scores(full=False):
+    # Rescores agencies whose AgencyPerformance changed (--mode score, triggered by the writers)
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        updated = refresh_agency_scores(cur, full=full)
+        conn.commit()
+        print(f"[Allocation.py] Agency scores refreshed: {updated} updated.")
+    except Exception as e:
+        print(f"[Allocation.py] Failed to refresh agency scores: {e}")
+        conn.rollback()
+        sys.exit(1)
+    finally:
+        cur.close()
+        conn.close()
+
+def refresh_dirty_scores(conn, cur):
+    # Flag lookup on "Agency"; history is only read for agencies a writer flagged (or never scored,
+    # e.g. right after deploy), so a pending rescore cannot leave agencies on DEFAULT_SCORE
+    updated = refresh_agency_scores(cur)
+    conn.commit()
+    if updated:
+        print(f"[Allocation.py] Rescored {updated} flagged agencies.")
+
 # AGENCIES global removed. Load locally in functions.
 
 # --- HELPER: LOG AUDIT ---
@@ -73,6 +93,91 @@ def log_audit(cur, case_id, actor_id, action, details):
         (log_id, case_id, actor_id, action, details, timestamp)
     )
 
+# --- HELPER: SLA DEADLINES ---
+# Hours an agency has to act on an assigned case before the offer is revoked.
+SLA_LIMIT_HOURS = {'HIGH': 24, 'MEDIUM': 72, 'LOW': 120}
+
+def parse_db_timestamp(value):
+    # "assignedAt" comes back as a naive datetime (timestamp(3)) or as an ISO string
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+def get_sla_limit(priority):
+    return SLA_LIMIT_HOURS.get(priority, SLA_LIMIT_HOURS['LOW'])
+
+def get_sla_deadline(priority, assigned_at):
+    return parse_db_timestamp(assigned_at) + datetime.timedelta(hours=get_sla_limit(priority))
+
+def revoke_breached_case(cur, case_row, agency_name):
+    # Conditional on the assignment we evaluated, so a case reassigned or closed in between is left alone
+    limit = get_sla_limit(case_row['priority'])
+    breach_iso = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    cur.execute(
+        'UPDATE "Case" SET "updatedAt" = (NOW() AT TIME ZONE \'UTC\'), "status" = \'REVOKED\', "currentSLAStatus" = \'BREACHED\', "assignedToId" = NULL, "slaBreachTime" = %s '
+        'WHERE "id" = %s AND "status" = \'ASSIGNED\' AND "currentSLAStatus" = \'ACTIVE\' AND "assignedToId" IS NOT DISTINCT FROM %s AND "assignedAt" = %s',
+        (breach_iso, case_row['id'], case_row['assignedToId'], case_row['assignedAt'])
+    )
+    if cur.rowcount == 0:
+        return False
+
+    log_audit(cur, case_row['id'], 'SYSTEM_DAEMON', 'SLA_BREACH', f"Offer revoked. Timeout > {limit}h. Agency {agency_name} penalized.")
+    return True
+
+# --- HELPER: REJECTION HISTORY ---
+# In-process cache of "CaseRejection": case_id -> set of agency ids that rejected it
+_REJECTION_CACHE = {}
+
+def record_rejection(cur, case_id, agency_id, reason=None):
+    now_iso = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    cur.execute(
+        'INSERT INTO "CaseRejection" ("caseId", "agencyId", "reason", "rejectedAt") VALUES (%s, %s, %s, %s) ON CONFLICT ("caseId", "agencyId") DO NOTHING',
+        (case_id, agency_id, reason, now_iso)
+    )
+    _REJECTION_CACHE.setdefault(case_id, set()).add(agency_id)
+
+def load_rejections(cur, case_ids):
+    # One primary-key range lookup for a whole batch; independent of AuditLog size
+    case_ids = list(case_ids)
+    if not case_ids:
+        return
+    cur.execute('SELECT "caseId", "agencyId" FROM "CaseRejection" WHERE "caseId" = ANY(%s)', (case_ids,))
+    for cid in case_ids:
+        _REJECTION_CACHE[cid] = set()
+    for r in cur.fetchall():
+        _REJECTION_CACHE[r['caseId']].add(r['agencyId'])
+
+def get_rejected_agency_ids(cur, case_id, refresh=False):
+    if refresh or case_id not in _REJECTION_CACHE:
+        load_rejections(cur, [case_id])
+    return _REJECTION_CACHE[case_id]
+
+def backfill_rejection_history():
+    # One-off: seed "CaseRejection" from rejections already recorded in the audit trail
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute(
+            'INSERT INTO "CaseRejection" ("caseId", "agencyId", "reason", "rejectedAt") '
+            'SELECT l."caseId", l."actorId", MIN(l."details"), MIN(l."timestamp") FROM "AuditLog" l '
+            'JOIN "Case" c ON c."id" = l."caseId" '
+            'WHERE l."action" IN (\'REJECT\', \'REJECTION\', \'REJECTED\') '
+            'GROUP BY l."caseId", l."actorId" '
+            'ON CONFLICT ("caseId", "agencyId") DO NOTHING'
+        )
+        inserted = cur.rowcount
+        conn.commit()
+        print(f"[Allocation.py] Rejection history backfilled: {inserted} rows.")
+    except Exception as e:
+        print(f"Error in rejection backfill: {e}")
+        conn.rollback()
+        sys.exit(1)
+    finally:
+        cur.close()
+        conn.close()
+
 # --- HELPER: GET CASE / LOAD ---
 def get_agency_load(cur, agency_id):
     cur.execute(
@@ -93,6 +198,7 @@ def ingest_mock_data():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     try:
+        refresh_dirty_scores(conn, cur)
         agencies = load_agencies()
         print("[Allocation.py] Starting Ingestion with Agencies:", [a['name'] for a in agencies])
         
@@ -279,6 +385,8 @@ def reallocate_case(case_id, rejected_by_agency_id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     try:
+        refresh_dirty_scores(conn, cur)
+
         # Get Case
         cur.execute('SELECT * FROM "Case" WHERE "id" = %s', (case_id,))
         case_row = cur.fetchone()
@@ -289,19 +397,19 @@ def reallocate_case(case_id, rejected_by_agency_id):
         
         print(f"[Allocation.py] Reallocating Case {case_id} (Priority: {priority})...")
 
+        # Idempotent: the web app normally records it already when the agency rejects
+        record_rejection(cur, case_id, rejected_by_agency_id)
+
         # RULE 1: Low Priority -> Queue
         if priority == 'LOW':
-            cur.execute('UPDATE "Case" SET "status" = \'QUEUED\', "assignedToId" = NULL, "assignedAt" = NULL WHERE "id" = %s', (case_id,))
+            cur.execute('UPDATE "Case" SET "updatedAt" = (NOW() AT TIME ZONE \'UTC\'), "status" = \'QUEUED\', "assignedToId" = NULL, "assignedAt" = NULL WHERE "id" = %s', (case_id,))
             log_audit(cur, case_id, 'SYSTEM', 'QUEUE_RETURN', 'Low priority rejection. Returned to Queue.')
             conn.commit()
             print("Action: Low Priority -> Queue")
             return 
 
         # RULE 2: High/Medium -> Search
-        cur.execute('SELECT "actorId" FROM "AuditLog" WHERE "caseId" = %s AND "action" IN (\'REJECTION\', \'REJECTED\')', (case_id,))
-        past_rejectors_rows = cur.fetchall()
-        rejected_agency_ids = {r['actorId'] for r in past_rejectors_rows}
-        rejected_agency_ids.add(rejected_by_agency_id)
+        rejected_agency_ids = get_rejected_agency_ids(cur, case_id, refresh=True)
         
         agencies = load_agencies()
         candidates = [a for a in agencies if a['id'] not in rejected_agency_ids]
@@ -335,14 +443,14 @@ def reallocate_case(case_id, rejected_by_agency_id):
 
             if swap_case_id:
                 cur.execute(
-                    'UPDATE "Case" SET "status" = \'QUEUED\', "assignedToId" = NULL, "assignedAt" = NULL, "currentSLAStatus" = \'PENDING\' WHERE "id" = %s',
+                    'UPDATE "Case" SET "updatedAt" = (NOW() AT TIME ZONE \'UTC\'), "status" = \'QUEUED\', "assignedToId" = NULL, "assignedAt" = NULL, "currentSLAStatus" = \'PENDING\' WHERE "id" = %s',
                     (swap_case_id,)
                 )
                 log_audit(cur, swap_case_id, 'SYSTEM', 'DISPLACEMENT', f"Displaced by High Priority Case {case_id}. Sent to Queue.")
                 print(f"Action: Swapped out {swap_case_id}")
             
             cur.execute(
-                'UPDATE "Case" SET "status" = \'ASSIGNED\', "assignedToId" = %s, "assignedAt" = %s, "currentSLAStatus" = \'ACTIVE\' WHERE "id" = %s',
+                'UPDATE "Case" SET "updatedAt" = (NOW() AT TIME ZONE \'UTC\'), "status" = \'ASSIGNED\', "assignedToId" = %s, "assignedAt" = %s, "currentSLAStatus" = \'ACTIVE\' WHERE "id" = %s',
                 (chosen_agency['id'], now_iso, case_id)
             )
             
@@ -350,7 +458,7 @@ def reallocate_case(case_id, rejected_by_agency_id):
             log_audit(cur, case_id, 'SYSTEM', 'REALLOCATION', details)
             print(f"Action: {details}")
         else:
-            cur.execute('UPDATE "Case" SET "status" = \'QUEUED\', "assignedToId" = NULL WHERE "id" = %s', (case_id,))
+            cur.execute('UPDATE "Case" SET "updatedAt" = (NOW() AT TIME ZONE \'UTC\'), "status" = \'QUEUED\', "assignedToId" = NULL WHERE "id" = %s', (case_id,))
             log_audit(cur, case_id, 'SYSTEM', 'QUEUE_WAIT', "All eligible agencies full or rejected. Queued.")
             print("Action: Agencies Full/Rejected -> Queue")
 
@@ -382,32 +490,18 @@ def check_sla_breaches():
             if not row['assignedAt']: continue
             
             try:
-                assigned_at = row['assignedAt']
-                # If assigned_at is string (it is in simple fetch), parse it
-                if isinstance(assigned_at, str):
-                     assigned_at = datetime.datetime.fromisoformat(assigned_at.replace('Z', '+00:00'))
+                deadline = get_sla_deadline(row['priority'], row['assignedAt'])
             except ValueError:
                 continue
-
-            elapsed_hours = (now_dt - assigned_at).total_seconds() / 3600.0
-            
-            limit = 120 
-            if row['priority'] == 'HIGH': limit = 24 
-            elif row['priority'] == 'MEDIUM': limit = 72 
             
-            if elapsed_hours > limit:
-                cur.execute(
-                    'UPDATE "Case" SET "status" = \'REVOKED\', "currentSLAStatus" = \'BREACHED\', "assignedToId" = NULL WHERE "id" = %s',
-                    (row['id'],)
-                )
-                
+            if now_dt > deadline:
                 agency_name = "Unknown Agency"
                 if row['assignedToId']:
                     ag = next((a for a in agencies if a['id'] == row['assignedToId']), None)
                     if ag: agency_name = ag['name']
                 
-                log_audit(cur, row['id'], 'SYSTEM_DAEMON', 'SLA_BREACH', f"Offer revoked. Timeout > {limit}h. Agency {agency_name} penalized.")
-                revoked_count += 1
+                if revoke_breached_case(cur, row, agency_name):
+                    revoked_count += 1
                 
         conn.commit()
         print(f"[Allocation.py] SLA Check Complete. Revoked: {revoked_count}")
@@ -424,13 +518,61 @@ def check_sla_breaches():
         cur.close()
         conn.close()
 
+# --- ALLOCATION STRATEGIES ---
+def get_hp_threshold(agency):
+    # RELAXED LOGIC (Same as Ingestion): max HIGH priority cases an agency may hold
+    if agency['score'] > 0.85:
+        return agency['totalCapacity']
+    elif agency['score'] > 0.70:
+        return int(agency['totalCapacity'] * 0.80)
+    elif agency['score'] > 0.50:
+        return int(agency['totalCapacity'] * 0.50)
+    return 0
+
+def greedy_assign(queue, agencies, load, hp_load, rejections):
+    # First fit: cases in priority order, each to the highest-scoring agency with room
+    load = dict(load)
+    hp_load = dict(hp_load)
+    sorted_agencies = sorted(agencies, key=lambda x: x['score'], reverse=True)
+    priority_map = {'HIGH': 0, 'MEDIUM': 1, 'LOW': 2}
+
+    assignments = {}
+    for case_item in sorted(queue, key=lambda x: priority_map.get(x['priority'], 2)):
+        rejected_agency_ids = rejections.get(case_item['id'], set())
+        for agency in sorted_agencies:
+            if agency['id'] in rejected_agency_ids:
+                continue
+            if load[agency['id']] >= agency['totalCapacity']:
+                continue
+            if case_item['priority'] == 'HIGH':
+                if hp_load[agency['id']] >= get_hp_threshold(agency):
+                    continue
+                hp_load[agency['id']] += 1
+
+            load[agency['id']] += 1
+            assignments[case_item['id']] = agency['id']
+            break
+    return assignments
+
+def count_high(assignments, cases):
+    high = {c['id'] for c in cases if c['priority'] == 'HIGH'}
+    return sum(1 for cid in assignments if cid in high)
+
+def expected_recovery(assignments, cases, agencies):
+    # Sum of case value (amount x recovery probability) x agency score
+    value = {c['id']: c['value'] for c in cases}
+    score = {a['id']: a['score'] for a in agencies}
+    return sum(value[cid] * score[aid] for cid, aid in assignments.items())
+
 # --- ALGORITHM 4: ALLOCATE EXISTING ---
-def allocate_existing_cases():
+def allocate_existing_cases(strategy='greedy'):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     try:
+        refresh_dirty_scores(conn, cur)
+
         print("[Allocation.py] Fetching unassigned cases...")
-        cur.execute('SELECT * FROM "Case" WHERE "status" IN (\'NEW\', \'QUEUED\') AND "assignedToId" IS NULL')
+        cur.execute('SELECT c.*, i."amount" FROM "Case" c JOIN "Invoice" i ON i."id" = c."invoiceId" WHERE c."status" IN (\'NEW\', \'QUEUED\') AND c."assignedToId" IS NULL')
         rows = cur.fetchall()
         
         if not rows:
@@ -447,11 +589,16 @@ def allocate_existing_cases():
             main_queue.append({
                 'id': r['id'],
                 'priority': p,
-                'aiScore': float(r['aiScore']) if r['aiScore'] else 50.0
+                'aiScore': float(r['aiScore']) if r['aiScore'] else 50.0,
+                'value': float(r['amount'] or 0) * float(r['recoveryProbability'] or 0)
             })
 
         assignments = {}
         
+        # Agencies that already rejected a case never get it back (cache holds this batch only)
+        _REJECTION_CACHE.clear()
+        load_rejections(cur, [c['id'] for c in main_queue])
+
         # Logic: Reserve for Probationary
         reserve_count = max(1, int(len(main_queue) * 0.10))
         queue_copy = list(main_queue) 
@@ -464,55 +611,43 @@ def allocate_existing_cases():
                 if booked >= reserve_count: break
                 c = queue_copy[i]
                 if c['priority'] == 'MEDIUM':
-                     target_newbie = newbies[booked % len(newbies)]
+                     # Round-robin, skipping newbies that already rejected this case
+                     rotation = (newbies[(booked + k) % len(newbies)] for k in range(len(newbies)))
+                     target_newbie = next((n for n in rotation if n['id'] not in _REJECTION_CACHE[c['id']]), None)
+                     if not target_newbie: continue
                      assignments[c['id']] = target_newbie['id']
                      booked += 1
                      queue_copy.pop(i)
 
         # Logic: Main Allocation
-        sorted_agencies = sorted(agencies, key=lambda x: x['score'], reverse=True)
-        priority_map = {'HIGH': 0, 'MEDIUM': 1, 'LOW': 2}
-        
-        def get_prio(x):
-            return priority_map.get(x['priority'], 2)
-
-        queue_copy.sort(key=get_prio)
-        
-        for case_item in queue_copy:
-            for agency in sorted_agencies:
-                # Check current DB load + batch assignments
-                current_db_load = get_agency_load(cur, agency['id'])
-                batch_assigned = sum(1 for cid, aid in assignments.items() if aid == agency['id'])
-                total_load = current_db_load + batch_assigned
-                
-                if total_load >= agency['totalCapacity']: 
-                    continue
-                
-                # HP Threshold logic 
-                if case_item['priority'] == 'HIGH':
-                    # RELAXED LOGIC (Same as Ingestion)
-                    if agency['score'] > 0.85:
-                        threshold = agency['totalCapacity']
-                    elif agency['score'] > 0.70:
-                        threshold = int(agency['totalCapacity'] * 0.80)
-                    elif agency['score'] > 0.50:
-                        threshold = int(agency['totalCapacity'] * 0.50)
-                    else:
-                        threshold = 0
-                    
-                    current_hp_load = get_agency_hp_load(cur, agency['id'])
-                    batch_hp = 0
-                    for cid, aid in assignments.items():
-                        if aid == agency['id']:
-                            c_p = next((x['priority'] for x in main_queue if x['id'] == cid), 'LOW')
-                            if c_p == 'HIGH':
-                                batch_hp += 1
-                    
-                    if (current_hp_load + batch_hp) >= threshold:
-                        continue
-                
-                assignments[case_item['id']] = agency['id']
-                break
+        # Loads are read once; the batch is then tracked in memory
+        load = {a['id']: get_agency_load(cur, a['id']) for a in agencies}
+        hp_load = {a['id']: get_agency_hp_load(cur, a['id']) for a in agencies}
+        for aid in assignments.values():
+            load[aid] += 1
+
+        greedy = greedy_assign(queue_copy, agencies, load, hp_load, _REJECTION_CACHE)
+
+        if strategy == 'optimal':
+            capacity_left = {a['id']: a['totalCapacity'] - load[a['id']] for a in agencies}
+            hp_capacity_left = {a['id']: get_hp_threshold(a) - hp_load[a['id']] for a in agencies}
+            optimal = optimal_assign(queue_copy, agencies, capacity_left, hp_capacity_left, _REJECTION_CACHE)
+
+            # Plans compare on HIGH cases placed first, expected recovery second. Bucketing and the
+            # rejection fix-up are approximations, so never ship a plan that loses to greedy on that order.
+            greedy_high = count_high(greedy, main_queue)
+            optimal_high = count_high(optimal, main_queue)
+            greedy_value = expected_recovery(greedy, main_queue, agencies)
+            optimal_value = expected_recovery(optimal, main_queue, agencies)
+            print(f"[Allocation.py] HIGH cases placed - greedy: {greedy_high}, optimal: {optimal_high}")
+            if (optimal_high, optimal_value) >= (greedy_high, greedy_value):
+                print(f"[Allocation.py] Expected recovery - greedy: {greedy_value:,.2f}, optimal: {optimal_value:,.2f}, gain: {optimal_value - greedy_value:,.2f}")
+                assignments.update(optimal)
+            else:
+                print("[Allocation.py] Greedy plan is better for this batch; using it.")
+                assignments.update(greedy)
+        else:
+            assignments.update(greedy)
 
         # Commit Updates
         print(f"[Allocation.py] Committing {len(assignments)} assignments...")
@@ -520,7 +655,7 @@ def allocate_existing_cases():
         
         for cid, aid in assignments.items():
             cur.execute(
-                'UPDATE "Case" SET "status" = \'ASSIGNED\', "assignedToId" = %s, "assignedAt" = %s, "currentSLAStatus" = \'ACTIVE\' WHERE "id" = %s',
+                'UPDATE "Case" SET "updatedAt" = (NOW() AT TIME ZONE \'UTC\'), "status" = \'ASSIGNED\', "assignedToId" = %s, "assignedAt" = %s, "currentSLAStatus" = \'ACTIVE\' WHERE "id" = %s',
                 (aid, now_iso, cid)
             )
             log_audit(cur, cid, 'SYSTEM', 'ASSIGNMENT', f"Auto-allocated to {aid}")
@@ -538,9 +673,12 @@ def allocate_existing_cases():
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--mode', choices=['ingest', 'reallocate', 'check_sla', 'allocate'], required=True)
+    parser.add_argument('--mode', choices=['ingest', 'reallocate', 'check_sla', 'sla_daemon', 'allocate', 'score', 'backfill_rejections'], required=True)
     parser.add_argument('--case_id')
     parser.add_argument('--rejected_by')
+    parser.add_argument('--poll_seconds', type=float, default=30.0)
+    parser.add_argument('--full', action='store_true')
+    parser.add_argument('--strategy', choices=['greedy', 'optimal'], default='greedy')
     
     args = parser.parse_args()
     
@@ -553,5 +691,12 @@ if __name__ == '__main__':
             reallocate_case(args.case_id, args.rejected_by)
     elif args.mode == 'check_sla':
         check_sla_breaches()
+    elif args.mode == 'sla_daemon':
+        from SLAScheduler import run_sla_daemon
+        run_sla_daemon(poll_seconds=args.poll_seconds)
     elif args.mode == 'allocate':
-        allocate_existing_cases()
\ No newline at end of file
+        allocate_existing_cases(strategy=args.strategy)
+    elif args.mode == 'score':
+        refresh_scores(full=args.full)
+    elif args.mode == 'backfill_rejections':
+        backfill_rejection_history()
\ No newline at end of file
@@ -0,0 +1,195 @@
+import psycopg2
+import datetime
+import sys
+import argparse
+import json
+import os
+import pandas as pd
+
+from Allocation import get_db_connection
+
+# --- EXPORT DEFINITIONS ---
+# Each export is a single SELECT filtered on a half-open [since, until) window of its watermark column.
+# Column types are fixed up front so every Parquet row group shares one schema.
+EXPORTS = {
+    'allocations': {
+        'query': (
+            'SELECT c."id" AS "caseId", i."invoiceNumber", i."amount", i."currency", i."dueDate", '
+            'i."customerID", i."customerName", i."region", i."status" AS "invoiceStatus", '
+            'c."priority", c."aiScore", c."recoveryProbability", c."status", c."currentSLAStatus", '
+            'c."assignedToId", a."id" AS "agencyId", a."name" AS "agencyName", '
+            'c."assignedAt", c."slaBreachTime", c."updatedAt", i."updatedAt" AS "invoiceUpdatedAt" '
+            'FROM "Case" c '
+            'JOIN "Invoice" i ON i."id" = c."invoiceId" '
+            'LEFT JOIN "User" u ON u."id" = c."assignedToId" '
+            'LEFT JOIN "Agency" a ON a."id" = COALESCE(u."agencyId", c."assignedToId")'
+        ),
+        # A row changes when either side does: Case writers (Prisma @updatedAt, raw UPDATEs in
+        # Allocation.py) bump the case, while invoice edits (e.g. amount upserts) only bump the invoice
+        'watermark': 'GREATEST(c."updatedAt", i."updatedAt")',
+        'order_by': 'c."id"',
+        'columns': {
+            'caseId': 'string', 'invoiceNumber': 'string', 'amount': 'float64', 'currency': 'string',
+            'dueDate': 'datetime64[ns]', 'customerID': 'string', 'customerName': 'string', 'region': 'string',
+            'invoiceStatus': 'string', 'priority': 'string', 'aiScore': 'float64', 'recoveryProbability': 'float64',
+            'status': 'string', 'currentSLAStatus': 'string', 'assignedToId': 'string', 'agencyId': 'string',
+            'agencyName': 'string', 'assignedAt': 'datetime64[ns]', 'slaBreachTime': 'datetime64[ns]',
+            'updatedAt': 'datetime64[ns]', 'invoiceUpdatedAt': 'datetime64[ns]',
+        },
+    },
+    'audit': {
+        'query': (
+            'SELECT l."id", l."caseId", l."entityType", l."actorId", l."actorRole", l."action", '
+            'l."details", l."timestamp" '
+            'FROM "AuditLog" l'
+        ),
+        'watermark': 'l."timestamp"',
+        'order_by': 'l."timestamp", l."id"',
+        'columns': {
+            'id': 'string', 'caseId': 'string', 'entityType': 'string', 'actorId': 'string',
+            'actorRole': 'string', 'action': 'string', 'details': 'string', 'timestamp': 'datetime64[ns]',
+        },
+    },
+}
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Writers stamp "timestamp"/"updatedAt" before they commit. The default upper bound trails the
+# DB clock by this much so rows still in flight are picked up by the next incremental run.
+EXPORT_SAFETY_LAG = datetime.timedelta(minutes=5)
+
+# --- HELPERS ---
+def parse_timestamp(value):
+    # DB timestamps are naive UTC (timestamp(3)); normalise CLI/watermark input to match
+    ts = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+def read_watermark(path, export_name):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        value = json.load(f).get(export_name)
+    return parse_timestamp(value) if value else None
+
+def write_watermark(path, export_name, until):
+    state = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            state = json.load(f)
+    state[export_name] = until.isoformat() + 'Z'
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def build_query(cur, spec, since, until):
+    clauses = [f'{spec["watermark"]} < %s']
+    params = [until]
+    if since is not None:
+        clauses.insert(0, f'{spec["watermark"]} >= %s')
+        params.insert(0, since)
+    sql = f'{spec["query"]} WHERE {" AND ".join(clauses)} ORDER BY {spec["order_by"]}'
+    return cur.mogrify(sql, params).decode()
+
+# --- WRITERS ---
+def export_csv(conn, sql, out_path):
+    # COPY streams straight from the server into the file; nothing is buffered in Python
+    cur = conn.cursor()
+    try:
+        with open(out_path, 'w', encoding='utf-8', newline='') as f:
+            cur.copy_expert(f'COPY ({sql}) TO STDOUT WITH (FORMAT CSV, HEADER)', f)
+        return cur.rowcount
+    finally:
+        cur.close()
+
+def export_parquet(conn, sql, out_path, columns, chunk_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("[Export.py] Parquet export requires pyarrow (pip install pyarrow).")
+        sys.exit(1)
+
+    names = list(columns)
+    schema = pa.Schema.from_pandas(pd.DataFrame({n: pd.Series(dtype=t) for n, t in columns.items()}), preserve_index=False)
+
+    # Named (server-side) cursor: rows arrive chunk_size at a time, one Parquet row group each
+    cur = conn.cursor(name=f'export_{os.getpid()}')
+    cur.itersize = chunk_size
+    total = 0
+    writer = pq.ParquetWriter(out_path, schema)
+    try:
+        cur.execute(sql)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            df = pd.DataFrame.from_records(rows, columns=names).astype(columns)
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            total += len(rows)
+    finally:
+        writer.close()
+        cur.close()
+    return total
+
+# --- ENTRY POINT ---
+def run_export(export_name, out_path, fmt='csv', since=None, until=None, watermark_file=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    spec = EXPORTS[export_name]
+    if since is None:
+        since = read_watermark(watermark_file, export_name)
+
+    conn = get_db_connection()
+    try:
+        # One snapshot for the whole export, so the watermark matches what was written
+        conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        cur = conn.cursor()
+        if until is None:
+            cur.execute("SELECT NOW() AT TIME ZONE 'UTC'")
+            until = cur.fetchone()[0] - EXPORT_SAFETY_LAG
+        sql = build_query(cur, spec, since, until)
+        cur.close()
+
+        window = f"{since.isoformat() if since else 'beginning'} -> {until.isoformat()}"
+        print(f"[Export.py] Exporting {export_name} ({window}) to {out_path} as {fmt}...")
+
+        if fmt == 'parquet':
+            total = export_parquet(conn, sql, out_path, spec['columns'], chunk_size)
+        else:
+            total = export_csv(conn, sql, out_path)
+        conn.commit()
+
+        if watermark_file:
+            write_watermark(watermark_file, export_name, until)
+        print(f"[Export.py] Export complete. Rows: {total}")
+        return total
+
+    except Exception as e:
+        print(f"Error in export: {e}")
+        conn.rollback()
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--export', choices=list(EXPORTS), required=True)
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--since', help='Inclusive lower bound (ISO timestamp, UTC). Defaults to the stored watermark.')
+    parser.add_argument('--until', help='Exclusive upper bound (ISO timestamp, UTC). Defaults to DB time minus a safety lag.')
+    parser.add_argument('--watermark_file', help='JSON file holding the last exported upper bound per export.')
+    parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    args = parser.parse_args()
+
+    run_export(
+        args.export,
+        args.out,
+        fmt=args.format,
+        since=parse_timestamp(args.since) if args.since else None,
+        until=parse_timestamp(args.until) if args.until else None,
+        watermark_file=args.watermark_file,
+        chunk_size=args.chunk_size,
+    )
@@ -0,0 +1,237 @@
+from collections import deque
+import heapq
+import numpy as np
+
+# --- CONFIG ---
+NUM_VALUE_BUCKETS = 32  # Quantile buckets over case value (amount x recovery probability)
+
+# --- MIN-COST FLOW ---
+class MinCostFlow:
+    """
+    Successive shortest paths using Dijkstra on reduced costs (Johnson potentials).
+    Negative edge costs are allowed; potentials are seeded once with Bellman-Ford.
+    Costs are integers; the graph is small because cases are aggregated into buckets first.
+    """
+
+    def __init__(self, num_nodes):
+        self.graph = [[] for _ in range(num_nodes)]
+        # Edge: [to, capacity, cost, index of reverse edge]
+
+    def add_edge(self, u, v, capacity, cost):
+        self.graph[u].append([v, capacity, cost, len(self.graph[v])])
+        self.graph[v].append([u, 0, -cost, len(self.graph[u]) - 1])
+        return (u, len(self.graph[u]) - 1)
+
+    def flow_on(self, edge_ref):
+        u, i = edge_ref
+        v, _, _, rev = self.graph[u][i]
+        return self.graph[v][rev][1]
+
+    def _initial_potentials(self, source):
+        # Bellman-Ford (queue based) over the initial residual graph, which has no negative cycles
+        n = len(self.graph)
+        dist = [None] * n
+        dist[source] = 0
+        queue = deque([source])
+        in_queue = [False] * n
+        while queue:
+            u = queue.popleft()
+            in_queue[u] = False
+            for v, cap, cost, _ in self.graph[u]:
+                if cap > 0 and (dist[v] is None or dist[u] + cost < dist[v]):
+                    dist[v] = dist[u] + cost
+                    if not in_queue[v]:
+                        in_queue[v] = True
+                        queue.append(v)
+        return [d if d is not None else 0 for d in dist]
+
+    def solve(self, source, sink):
+        # Augments while the cheapest path still has non-positive cost (i.e. assigning does not lose value)
+        n = len(self.graph)
+        potential = self._initial_potentials(source)
+        total_flow, total_cost = 0, 0
+        while True:
+            dist = [None] * n
+            prev = [None] * n
+            dist[source] = 0
+            heap = [(0, source)]
+            while heap:
+                d, u = heapq.heappop(heap)
+                if d > dist[u]:
+                    continue
+                for i, (v, cap, cost, _) in enumerate(self.graph[u]):
+                    if cap <= 0:
+                        continue
+                    nd = d + cost + potential[u] - potential[v]
+                    if dist[v] is None or nd < dist[v]:
+                        dist[v] = nd
+                        prev[v] = (u, i)
+                        heapq.heappush(heap, (nd, v))
+
+            if dist[sink] is None:
+                break
+            for v in range(n):
+                if dist[v] is not None:
+                    potential[v] += dist[v]
+            path_cost = potential[sink] - potential[source]
+            if path_cost > 0:
+                break
+
+            push = None
+            v = sink
+            while v != source:
+                u, i = prev[v]
+                cap = self.graph[u][i][1]
+                push = cap if push is None else min(push, cap)
+                v = u
+
+            v = sink
+            while v != source:
+                u, i = prev[v]
+                edge = self.graph[u][i]
+                edge[1] -= push
+                self.graph[v][edge[3]][1] += push
+                v = u
+
+            total_flow += push
+            total_cost += push * path_cost
+        return total_flow, total_cost
+
+# --- BUCKETING ---
+def bucket_cases(cases):
+    """
+    Groups cases by (is HIGH, value quantile); each bucket's cases are sorted by value, highest first.
+    Rejections are deliberately not part of the key so the graph size is independent of them.
+    """
+    values = np.array([c['value'] for c in cases], dtype=float)
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, NUM_VALUE_BUCKETS + 1)[1:-1]))
+    bucket_idx = np.searchsorted(edges, values, side='right')
+
+    buckets = {}
+    for case_item, b in zip(cases, bucket_idx):
+        key = (case_item['priority'] == 'HIGH', int(b))
+        buckets.setdefault(key, []).append(case_item)
+
+    for members in buckets.values():
+        members.sort(key=lambda x: x['value'], reverse=True)
+    return buckets
+
+# --- SOLVER ---
+PRIORITY_TIERS = ('HIGH', 'MEDIUM', 'LOW')
+
+def optimal_assign(cases, agencies, capacity_left, hp_capacity_left, rejections):
+    """
+    Maximises total expected recovery (case value x agency score) tier by tier, subject to
+    each agency's remaining capacity and remaining HIGH-priority threshold.
+    Returns {case_id: agency_id}; cases left out stay unassigned.
+
+    Tiers are solved in priority order on whatever capacity the previous tier left, so (like
+    greedy) a lower-priority case can never take a slot a higher-priority case could have used.
+    """
+    room = dict(capacity_left)
+    hp_room = dict(hp_capacity_left)
+    assignments = {}
+    for tier in PRIORITY_TIERS:
+        tier_cases = [c for c in cases if c['priority'] == tier]
+        placed = solve_tier(tier_cases, agencies, room, hp_room, rejections)
+        for aid in placed.values():
+            room[aid] -= 1
+            if tier == 'HIGH':
+                hp_room[aid] -= 1
+        assignments.update(placed)
+    return assignments
+
+def solve_tier(cases, agencies, capacity_left, hp_capacity_left, rejections):
+    """
+    Min-cost flow for one priority tier. The flow is solved on value buckets without rejections;
+    each bucket's per-agency quotas are then handed out skipping agencies a case was rejected by,
+    and any case that could not be placed is fitted into leftover capacity afterwards.
+    """
+    if not cases or not agencies:
+        return {}
+
+    buckets = bucket_cases(cases)
+    keys = list(buckets)
+
+    # Nodes: source, sink, one per bucket, then per agency an HP gate and the agency itself
+    source, sink = 0, 1
+    bucket_node = {k: 2 + i for i, k in enumerate(keys)}
+    base = 2 + len(keys)
+    gate_node = {a['id']: base + 2 * i for i, a in enumerate(agencies)}
+    agency_node = {a['id']: base + 2 * i + 1 for i, a in enumerate(agencies)}
+
+    mcf = MinCostFlow(base + 2 * len(agencies))
+    for a in agencies:
+        mcf.add_edge(gate_node[a['id']], agency_node[a['id']], max(0, hp_capacity_left[a['id']]), 0)
+        mcf.add_edge(agency_node[a['id']], sink, max(0, capacity_left[a['id']]), 0)
+
+    flow_edges = {}
+    for k in keys:
+        is_high, _ = k
+        members = buckets[k]
+        mean_value = sum(c['value'] for c in members) / len(members)
+        mcf.add_edge(source, bucket_node[k], len(members), 0)
+        # Cap each edge at the members that have not rejected that agency (exact for single-case buckets)
+        rejected_by = {}
+        for c in members:
+            for aid in rejections.get(c['id'], ()):
+                rejected_by[aid] = rejected_by.get(aid, 0) + 1
+        for a in agencies:
+            eligible = len(members) - rejected_by.get(a['id'], 0)
+            if eligible <= 0:
+                continue
+            target = gate_node[a['id']] if is_high else agency_node[a['id']]
+            gain_cents = int(round(mean_value * a['score'] * 100))
+            flow_edges[(k, a['id'])] = mcf.add_edge(bucket_node[k], target, eligible, -gain_cents)
+
+    mcf.solve(source, sink)
+
+    # Within a bucket, hand the most valuable cases to the highest-scoring agencies
+    assignments = {}
+    by_score = sorted(agencies, key=lambda x: x['score'], reverse=True)
+    for k in keys:
+        quota = [[a['id'], mcf.flow_on(flow_edges[(k, a['id'])])] for a in by_score if (k, a['id']) in flow_edges]
+        quota = [q for q in quota if q[1] > 0]
+        # Cases with rejections are the constrained ones; let them pick first so they are not left
+        # holding only slots of agencies they rejected (values within a bucket are close)
+        members = sorted(buckets[k], key=lambda x: not rejections.get(x['id']))
+        for case_item in members:
+            if not quota:
+                break
+            rejected = rejections.get(case_item['id'], ())
+            slot = next((q for q in quota if q[0] not in rejected), None)
+            if slot is None:
+                continue
+            assignments[case_item['id']] = slot[0]
+            slot[1] -= 1
+            if slot[1] == 0:
+                quota.remove(slot)
+
+    fill_remaining(cases, by_score, capacity_left, hp_capacity_left, rejections, assignments)
+    return assignments
+
+def fill_remaining(cases, by_score, capacity_left, hp_capacity_left, rejections, assignments):
+    # Fix-up after the solve: unplaced cases, most valuable first, go to the best agency with room
+    room = {a['id']: capacity_left[a['id']] for a in by_score}
+    hp_room = {a['id']: hp_capacity_left[a['id']] for a in by_score}
+    high = {c['id'] for c in cases if c['priority'] == 'HIGH'}
+    for cid, aid in assignments.items():
+        room[aid] -= 1
+        if cid in high:
+            hp_room[aid] -= 1
+
+    open_agencies = [a['id'] for a in by_score if room[a['id']] > 0]
+    for case_item in sorted((c for c in cases if c['id'] not in assignments), key=lambda x: x['value'], reverse=True):
+        if not open_agencies:
+            break
+        rejected = rejections.get(case_item['id'], ())
+        is_high = case_item['id'] in high
+        aid = next((a for a in open_agencies if a not in rejected and (not is_high or hp_room[a] > 0)), None)
+        if aid is None:
+            continue
+        assignments[case_item['id']] = aid
+        room[aid] -= 1
+        if is_high:
+            hp_room[aid] -= 1
+        if room[aid] == 0:
+            open_agencies.remove(aid)
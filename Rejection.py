@@ -29,6 +29,23 @@ def log_audit(conn, case_id, actor_id, action, details):
         (log_id, case_id, actor_id, action, details, timestamp)
     )
 
+def ensure_rejection_table(conn):
+    # Same shape as the Prisma "CaseRejection" model; created here for the local SQLite DB
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS CaseRejection (caseId TEXT NOT NULL, agencyId TEXT NOT NULL, reason TEXT, rejectedAt DATETIME NOT NULL, PRIMARY KEY (caseId, agencyId))"
+    )
+
+def record_rejection(conn, case_id, agency_id, reason):
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    conn.execute(
+        "INSERT OR IGNORE INTO CaseRejection (caseId, agencyId, reason, rejectedAt) VALUES (?, ?, ?, ?)",
+        (case_id, agency_id, reason, timestamp)
+    )
+
+def get_rejected_agency_ids(conn, case_id):
+    rows = conn.execute("SELECT agencyId FROM CaseRejection WHERE caseId = ?", (case_id,)).fetchall()
+    return {r['agencyId'] for r in rows}
+
 def get_agency_load(conn, agency_id):
     row = conn.execute(
         "SELECT COUNT(*) as count FROM 'Case' WHERE assignedToId = ? AND status IN ('ASSIGNED', 'WIP', 'PTP')", 
@@ -39,6 +56,8 @@ def get_agency_load(conn, agency_id):
 def process_rejection_logic(case_id, reason, rejected_by_id):
     conn = get_db_connection()
     try:
+        ensure_rejection_table(conn)
+
         # --- PART 1: THE REJECTION ---
         case = conn.execute("SELECT * FROM 'Case' WHERE id = ?", (case_id,)).fetchone()
         if not case:
@@ -62,6 +81,8 @@ def process_rejection_logic(case_id, reason, rejected_by_id):
             # Fallback if the Actor ID (agency) is invalid
             log_audit(conn, case_id, 'user-agency-alpha', 'REJECTION', f"Reason: {reason} (Logged by System)")
 
+        record_rejection(conn, case_id, rejected_by_id, reason)
+
         # 3. Stop if Low Priority
         if case['priority'] == 'LOW':
             print("[Rejection.py] Low priority case returned to queue.")
@@ -71,8 +92,9 @@ def process_rejection_logic(case_id, reason, rejected_by_id):
         # --- PART 2: THE REALLOCATION (Merged Logic) ---
         print("[Rejection.py] Attempting immediate reallocation...")
         
-        # Sort agencies by Score, excluding the one who just rejected it
-        candidates = [aid for aid in AGENCIES if aid != rejected_by_id]
+        # Sort agencies by Score, excluding every agency that has rejected it so far
+        rejected_ids = get_rejected_agency_ids(conn, case_id)
+        candidates = [aid for aid in AGENCIES if aid not in rejected_ids]
         candidates.sort(key=lambda x: AGENCIES[x]['score'], reverse=True)
 
         reallocated = False
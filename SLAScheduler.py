@@ -0,0 +1,217 @@
+import heapq
+import datetime
+import time
+import sys
+import argparse
+from psycopg2.extras import RealDictCursor
+
+from Allocation import (
+    get_db_connection,
+    load_agencies,
+    get_sla_deadline,
+    revoke_breached_case,
+    allocate_existing_cases,
+)
+
+ACTIVE_ASSIGNMENT_QUERY = (
+    'SELECT "id", "priority", "assignedToId", "assignedAt" FROM "Case" '
+    'WHERE "status" = \'ASSIGNED\' AND "currentSLAStatus" = \'ACTIVE\' AND "assignedAt" IS NOT NULL'
+)
+
+# "assignedAt" is stamped before the writer commits, so a row can become visible after a newer one.
+# Each sync re-reads this far behind the watermark, and a full rebuild runs periodically as a backstop.
+SYNC_OVERLAP = datetime.timedelta(minutes=10)
+FULL_REBUILD_SECONDS = 3600
+
+# --- DEADLINE HEAP ---
+class SLADeadlineScheduler:
+    """
+    Min-heap of SLA expiries, one live entry per assigned case.
+
+    Each entry is keyed by the assignment it was computed from (agency + assignedAt).
+    Reassigning a case produces a new key, so the old heap entry is skipped lazily
+    when it surfaces instead of being searched for and removed.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}  # case_id -> (deadline, assignedToId, assignedAt)
+        self._watermark = None  # newest "assignedAt" seen in the DB
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, row):
+        try:
+            deadline = get_sla_deadline(row['priority'], row['assignedAt'])
+        except ValueError:
+            return
+        entry = (deadline, row['assignedToId'], row['assignedAt'])
+        if self._entries.get(row['id']) == entry:
+            return
+        self._entries[row['id']] = entry
+        heapq.heappush(self._heap, (deadline, row['id'], entry))
+
+        if self._watermark is None or row['assignedAt'] > self._watermark:
+            self._watermark = row['assignedAt']
+
+    def cancel(self, case_id):
+        self._entries.pop(case_id, None)
+
+    def rebuild(self, cur):
+        # Startup: load every live assignment from "Case"
+        self._heap = []
+        self._entries = {}
+        self._watermark = None
+        cur.execute(ACTIVE_ASSIGNMENT_QUERY)
+        for row in cur.fetchall():
+            self.schedule(row)
+        print(f"[SLAScheduler.py] Rebuilt schedule with {len(self)} active assignments.")
+
+    def sync(self, cur):
+        # Only assignments made since the last pass (minus the overlap); schedule() skips ones already queued
+        if self._watermark is None:
+            return self.rebuild(cur)
+        cur.execute(ACTIVE_ASSIGNMENT_QUERY + ' AND "assignedAt" >= %s', (self._watermark - SYNC_OVERLAP,))
+        for row in cur.fetchall():
+            self.schedule(row)
+
+    def next_deadline(self):
+        while self._heap:
+            deadline, case_id, entry = self._heap[0]
+            if self._entries.get(case_id) == entry:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now_dt):
+        due = []
+        while self._heap and self._heap[0][0] <= now_dt:
+            deadline, case_id, entry = heapq.heappop(self._heap)
+            if self._entries.get(case_id) != entry:
+                continue
+            del self._entries[case_id]
+            due.append(case_id)
+        return due
+
+
+# --- EXPIRY HANDLING ---
+def expire_case(cur, scheduler, case_id, agencies):
+    # Re-read under lock: the case may have been reassigned, reprioritised or closed since it was scheduled
+    cur.execute('SELECT "id", "priority", "status", "currentSLAStatus", "assignedToId", "assignedAt" FROM "Case" WHERE "id" = %s FOR UPDATE', (case_id,))
+    row = cur.fetchone()
+    if not row or row['status'] != 'ASSIGNED' or row['currentSLAStatus'] != 'ACTIVE' or not row['assignedAt']:
+        return False
+
+    if get_sla_deadline(row['priority'], row['assignedAt']) > datetime.datetime.now(datetime.timezone.utc):
+        scheduler.schedule(row)
+        return False
+
+    agency_name = "Unknown Agency"
+    if row['assignedToId']:
+        ag = next((a for a in agencies if a['id'] == row['assignedToId']), None)
+        if ag: agency_name = ag['name']
+
+    return revoke_breached_case(cur, row, agency_name)
+
+def fire_due_deadlines(conn, scheduler):
+    due = scheduler.pop_due(datetime.datetime.now(datetime.timezone.utc))
+    if not due:
+        return 0
+
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        agencies = load_agencies()
+        revoked_count = 0
+        for case_id in due:
+            if expire_case(cur, scheduler, case_id, agencies):
+                revoked_count += 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    print(f"[SLAScheduler.py] {len(due)} deadlines reached. Revoked: {revoked_count}")
+    return revoked_count
+
+
+# --- DAEMON LOOP ---
+def run_allocation():
+    # allocate_existing_cases() exits the process on failure; the daemon must outlive a failed batch
+    try:
+        allocate_existing_cases()
+    except SystemExit:
+        print("[SLAScheduler.py] Reallocation after revocation failed; will retry on the next breach.")
+
+def run_sla_daemon(poll_seconds=30.0, once=False):
+    """
+    Sleeps until the earliest SLA expiry (or the next poll for new assignments)
+    instead of rescanning every active case on a fixed interval.
+    """
+    conn = None
+    scheduler = SLADeadlineScheduler()
+    last_rebuild = None
+    try:
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = get_db_connection()
+                    last_rebuild = None
+
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                if last_rebuild is None or time.monotonic() - last_rebuild >= FULL_REBUILD_SECONDS:
+                    scheduler.rebuild(cur)
+                    last_rebuild = time.monotonic()
+                cur.close()
+                conn.commit()
+
+                if fire_due_deadlines(conn, scheduler) > 0:
+                    print("[SLAScheduler.py] Triggering immediate reallocation for revoked cases...")
+                    run_allocation()
+
+                if once:
+                    break
+
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                scheduler.sync(cur)
+                cur.close()
+                conn.commit()
+
+            except (Exception, SystemExit) as e:
+                # Transient DB errors (or a failed reconnect) must not stop SLA enforcement
+                print(f"Error in SLA Scheduler: {e}")
+                if once:
+                    sys.exit(1)
+                # Deadlines popped before the failure are no longer in the heap; reload them
+                last_rebuild = None
+                if conn is not None and not conn.closed:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        conn.close()
+                time.sleep(poll_seconds)
+                continue
+
+            sleep_for = poll_seconds
+            next_deadline = scheduler.next_deadline()
+            if next_deadline is not None:
+                until_due = (next_deadline - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                sleep_for = max(0.0, min(poll_seconds, until_due))
+            time.sleep(sleep_for)
+
+    except KeyboardInterrupt:
+        print("[SLAScheduler.py] Stopped.")
+    finally:
+        if conn is not None and not conn.closed:
+            conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--poll_seconds', type=float, default=30.0)
+    parser.add_argument('--once', action='store_true')
+
+    args = parser.parse_args()
+
+    run_sla_daemon(poll_seconds=args.poll_seconds, once=args.once)
@@ -39,6 +39,7 @@ async function migrate() {
             update: {
                 name: agency.name,
                 capacity,
+                scoreDirty: true, // History is rewritten below
                 // status: 'ACTIVE' // Keep default
             },
             create: {
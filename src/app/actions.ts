@@ -106,6 +106,13 @@ export async function agencyRejectCase(
             }
         });
 
+        // Rejection history read by the allocator (avoids scanning AuditLog)
+        await prisma.caseRejection.upsert({
+            where: { caseId_agencyId: { caseId, agencyId } },
+            update: {},
+            create: { caseId, agencyId, reason }
+        });
+
         // ASYNC: Add to Queue instead of blocking wait
         await allocationQueue.add('reallocate-job', {
             caseId,
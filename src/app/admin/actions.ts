@@ -3,6 +3,7 @@
 import prisma from "@/lib/db";
 import { revalidatePath } from "next/cache";
 import { auth } from "@/auth";
+import { allocationQueue } from "@/lib/queue";
 
 // --- Types ---
 export type AdminActionResult<T = undefined> = {
@@ -171,6 +172,11 @@ export async function updateAgencyPerformance(id: string, month: string, metrics
             }
         });
 
+        // Flag for rescoring; the current score keeps being served until the rescore lands
+        await prisma.agency.update({ where: { id }, data: { scoreDirty: true } });
+        // ASYNC: rescore via the allocation worker; the next allocation batch also picks up the flag
+        await allocationQueue?.add('score-job', { args: ['--mode', 'score'] });
+
         await audit("UPDATE_PERFORMANCE", `Updated metrics for ${id} in ${month}`);
         revalidatePath('/admin/agencies');
         return ok();
@@ -5,6 +5,7 @@ import { revalidatePath } from "next/cache";
 import path from "path";
 import fs from "fs";
 import { spawn } from "child_process";
+import { allocationQueue } from "@/lib/queue";
 
 export async function getAgenciesAction() {
     try {
@@ -169,6 +170,14 @@ export async function uploadAgencyDataAction(formData: FormData) {
                                 }
                             });
                         }
+
+                        // Flag for rescoring (AgencyScoring.py)
+                        await prisma.agency.update({
+                            where: { id: agencyId },
+                            data: { scoreDirty: true }
+                        });
+                        // ASYNC: rescore via the allocation worker; the next allocation batch also picks up the flag
+                        await allocationQueue?.add('score-job', { args: ['--mode', 'score'] });
                     }
 
                     if (result.capacity) {
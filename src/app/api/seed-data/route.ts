@@ -27,7 +27,7 @@ export async function GET() {
 
                 await prisma.agency.upsert({
                     where: { id: agency.id },
-                    update: { name: agency.name, capacity },
+                    update: { name: agency.name, capacity, scoreDirty: true },
                     create: {
                         id: agency.id,
                         name: agency.name,
@@ -106,6 +106,9 @@ export async function GET() {
 
         // 3. Trigger Ingestion (Cases)
         // We call the Python script directly here
+        console.log("Scoring agencies...");
+        await runPythonBackground("Allocation.py", ["--mode", "score"]);
+
         console.log("Triggering Allocation.py ingest...");
         await runPythonBackground("Allocation.py", ["--mode", "ingest"]);
         results.push("Triggered Python Ingestion (Background)");